@@ -14,6 +14,7 @@
 # Import principali
 # ------------------------------------------------------------------------------
 import logging
+import threading
 
 # ------------------------------------------------------------------------------
 # Configurazione del logging
@@ -34,6 +35,10 @@ logging.getLogger("experta").setLevel(logging.WARNING)
 # Import del sistema esperto vero e proprio
 # ------------------------------------------------------------------------------
 from src.SistemaEsperto import consulenteRicette
+from src.ClassiSupporto import interfacciaConUtente
+
+# Risposte ammesse alla domanda finale
+_SI_NO = frozenset({'s', 'n'})
 
 
 # ------------------------------------------------------------------------------
@@ -58,6 +63,9 @@ def main():
     """
     logging.info("Sistema di Consulenza Ricette avviato. Benvenuto!")
 
+    # 🔹 Precarica ontologia e rete bayesiana mentre l'utente inserisce i dati
+    threading.Thread(target=interfacciaConUtente.precarica_risorse, daemon=True).start()
+
     while True:
         try:
             # 🔹 Avvio della consulenza principale
@@ -71,7 +79,7 @@ def main():
         # 🔹 Domanda finale all’utente
         print("\n" + "=" * 40)
         risposta = ""
-        while risposta not in ['s', 'n']:
+        while risposta not in _SI_NO:
             risposta = input("Vuoi avviare una nuova consulenza? (s/n): ").strip().lower()
 
         if risposta == 'n':
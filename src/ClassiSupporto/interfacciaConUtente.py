@@ -12,9 +12,13 @@
 # Import
 # --------------------------------------------------------------------------
 import logging
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
 from owlready2 import *
-import pandas as pd
 import os
+from pathlib import Path
 from src.ReteBayesiana import retiBayesiane as rb 
 
 # --------------------------------------------------------------------------
@@ -29,6 +33,82 @@ ingredienti_disponibili = []
 tempo = ""                   # 'poco', 'medio', 'molto'
 preferenze = []              # es. ['vegetariano']
 reteAggiornata = None        # Oggetto rete bayesiana appresa dal dataset
+_default_rete = None         # Rete bayesiana di default (costruita una sola volta)
+_lock_ontologia = threading.Lock()  # Un solo thread costruisce ontologia e indici, gli altri li riusano
+_lock_rete = threading.Lock()
+
+_INDICE_TEMPO = {"poco": 0, "medio": 1, "molto": 2}  # Categoria tempo -> stato della rete
+_INTERO_RE = re.compile(r"\s*([+-]?\d+)\s*")         # Numero intero (spazi ammessi)
+_MODALITA_RETE = frozenset({"1", "2"})               # 1=default, 2=dataset
+
+_PATH_ONTOLOGIA = "./src/Ontologia/ontologiaRicette.owl"
+# URI dell'ontologia calcolato una sola volta ('file://' + percorso assoluto con '/')
+_ONTOLOGY_URI = "file://" + Path(_PATH_ONTOLOGIA).resolve().as_posix()
+
+
+# --------------------------------------------------------------------------
+# Caricamento (unico) dell'ontologia
+# --------------------------------------------------------------------------
+def _normalizza_nome(nome):
+    """Normalizza un nome ('Pasta al Pomodoro', 'PastaAlPomodoro') per le ricerche."""
+    return nome.replace("_", "").replace(" ", "").lower()
+
+
+def _normalizza_ingrediente(valore):
+    """Riduce un ingrediente dell'ontologia (es. 'Ingrediente_Pasta') alla forma usata dall'utente ('pasta')."""
+    nome = valore.name if hasattr(valore, "name") else str(valore)
+    if nome.startswith("Ingrediente_"):
+        nome = nome[len("Ingrediente_"):]
+    return nome.replace("_", " ").strip().lower()
+
+
+def _load_ontology(uri_ontologia):
+    """
+    Carica l'ontologia una sola volta per processo e la riusa dalla memoria.
+    Le chiamate successive non rileggono né ri-analizzano il file OWL.
+    Il lock copre la chiamata in cache: se il precaricamento è in corso, chi arriva
+    attende che finisca e riceve lo stesso risultato, senza costruire di nuovo gli indici.
+    Ritorna la tupla (onto, indice_ingredienti, indice_nomi, indice_alternative):
+      - indice_ingredienti:  ingrediente normalizzato -> lista di ricette che lo usano
+      - indice_nomi:         nome normalizzato -> individuo
+      - indice_alternative:  nome dell'individuo -> nome di un altro individuo della stessa classe
+    """
+    with _lock_ontologia:
+        return _costruisci_indici_ontologia(uri_ontologia)
+
+
+@lru_cache(maxsize=1)
+def _costruisci_indici_ontologia(uri_ontologia):
+    """Legge il file OWL e costruisce gli indici (da chiamare solo tramite _load_ontology)."""
+    onto = get_ontology(uri_ontologia).load()
+    logger.debug("Ontologia caricata da: %s", uri_ontologia)
+
+    # Indici in memoria costruiti con un'unica scansione degli individui
+    indice_ingredienti = {}
+    indice_nomi = {}
+    indice_alternative = {}
+    istanze_per_classe = {}
+    for individuo in onto.individuals():
+        indice_nomi[_normalizza_nome(individuo.name)] = individuo
+        for ingrediente in getattr(individuo, "haIngrediente", []):
+            indice_ingredienti.setdefault(_normalizza_ingrediente(ingrediente), []).append(individuo)
+
+        # Alternativa: primo altro individuo della classe principale (is_a[0])
+        try:
+            classe = individuo.is_a[0]
+            if classe not in istanze_per_classe:
+                istanze_per_classe[classe] = list(classe.instances())
+            alternativa = next(
+                (alt.name for alt in istanze_per_classe[classe]
+                 if alt != individuo and hasattr(alt, "name")),
+                None
+            )
+            if alternativa:
+                indice_alternative[individuo.name] = alternativa
+        except Exception as e:
+            logger.debug("Nessuna alternativa per '%s'. Dettagli: %s", individuo.name, e)
+
+    return onto, indice_ingredienti, indice_nomi, indice_alternative
 
 
 # ==============================================================================
@@ -58,19 +138,20 @@ def chiedi_tempo_disponibile():
     """
     global tempo
     while True:
-        try:
-            risposta = input("Quanti minuti hai a disposizione? (es. 30): ").strip()
-            minuti = int(risposta)
-            if minuti <= 0:
-                print("Inserisci un numero positivo.")
-                continue
+        risposta = input("Quanti minuti hai a disposizione? (es. 30): ")
+        corrispondenza = _INTERO_RE.fullmatch(risposta)
+        if not corrispondenza:
+            print("Input non valido. Inserisci un numero intero (es. 30).")
+            continue
 
-            tempo = converti_tempo_in_categoria(minuti)
-            logger.debug(f"Minuti {minuti} -> Categoria Tempo: {tempo}")
-            return tempo
+        minuti = int(corrispondenza.group(1))
+        if minuti <= 0:
+            print("Inserisci un numero positivo.")
+            continue
 
-        except ValueError:
-            print("Input non valido. Inserisci un numero intero (es. 30).")
+        tempo = converti_tempo_in_categoria(minuti)
+        logger.debug("Minuti %s -> Categoria Tempo: %s", minuti, tempo)
+        return tempo
 
 
 def chiedi_preferenze_alimentari():
@@ -99,19 +180,13 @@ def trova_dettagli_ricetta_in_ontologia(nome_ricetta):
     Cerca i dettagli di una ricetta (tempo, descrizione, alternativa)
     nell’ontologia 'ontologiaRicette.owl'.
     """
-    path_ontologia = "./src/Ontologia/ontologiaRicette.owl"
-    
     try:
-        path = os.path.dirname(os.path.abspath(path_ontologia)).replace("\\", "/")
-        path_completo = f"file://{path}/{os.path.basename(path_ontologia)}"
-        onto = get_ontology(path_completo).load()
-        logger.debug(f"Ontologia caricata da: {path_completo}")
+        _, _, indice_nomi, indice_alternative = _load_ontology(_ONTOLOGY_URI)
     except Exception as e:
-        logger.error(f"Impossibile caricare il file ontologia '{path_ontologia}'. Dettagli: {e}")
+        logger.error(f"Impossibile caricare il file ontologia '{_PATH_ONTOLOGIA}'. Dettagli: {e}")
         return None
 
-    nome_individuo = nome_ricetta.replace(" ", "_")
-    individuo = onto.search_one(iri=f"*{nome_individuo}")
+    individuo = indice_nomi.get(_normalizza_nome(nome_ricetta))
 
     if individuo is None:
         logger.warning(f"Nessun dettaglio trovato nell'ontologia per '{nome_ricetta}'.")
@@ -128,16 +203,8 @@ def trova_dettagli_ricetta_in_ontologia(nome_ricetta):
         dettagli['descrizione'] = individuo.haDescrizionePassaggi[0]
         
     # Alternativa
-    try:
-        classe_ricetta = individuo.is_a[0]
-        altre_ricette = [
-            alt.name for alt in classe_ricetta.instances()
-            if alt != individuo and hasattr(alt, "name")
-        ]
-        if altre_ricette:
-            dettagli['alternativa'] = altre_ricette[0].replace("_", " ")
-    except Exception as e:
-        logger.debug(f"Nessuna alternativa trovata. Dettagli: {e}")
+    if individuo.name in indice_alternative:
+        dettagli['alternativa'] = indice_alternative[individuo.name].replace("_", " ")
             
     return dettagli
 
@@ -146,13 +213,9 @@ def cerca_ricette_parziali(lista_ingredienti):
     """
     Cerca ricette nell’ontologia che contengono almeno uno degli ingredienti forniti.
     """
-    logger.debug(f"Ricerca parziale per ingredienti: {lista_ingredienti}")
-    path_ontologia = "./src/Ontologia/ontologiaRicette.owl"
-    
+    logger.debug("Ricerca parziale per ingredienti: %s", lista_ingredienti)
     try:
-        path = os.path.dirname(os.path.abspath(path_ontologia)).replace("\\", "/")
-        path_completo = f"file://{path}/{os.path.basename(path_ontologia)}"
-        onto = get_ontology(path_completo).load()
+        onto, indice_ingredienti, _, _ = _load_ontology(_ONTOLOGY_URI)
     except Exception as e:
         logger.error(f"Errore caricamento ontologia per ricerca parziale: {e}")
         return
@@ -162,23 +225,19 @@ def cerca_ricette_parziali(lista_ingredienti):
         logger.warning(f"La proprietà '{NOME_PROPRIETA_INGREDIENTE}' non è stata trovata nell'ontologia.")
         return
 
-    ricette_trovate = {}
+    ricette_trovate = defaultdict(set)
 
     for ingrediente in lista_ingredienti:
-        try:
-            risultati = onto.search(**{NOME_PROPRIETA_INGREDIENTE: ingrediente})
-            for ricetta in risultati:
-                nome_ricetta = ricetta.name.replace("_", " ")
-                ricette_trovate.setdefault(nome_ricetta, []).append(ingrediente)
-        except Exception as e:
-            logger.warning(f"Errore nella ricerca per '{ingrediente}': {e}")
+        for ricetta in indice_ingredienti.get(_normalizza_ingrediente(ingrediente), []):
+            nome_ricetta = ricetta.name.replace("_", " ")
+            ricette_trovate[nome_ricetta].add(ingrediente)
 
     if not ricette_trovate:
         logger.info("Nessun suggerimento parziale trovato nell'ontologia.")
     else:
         logger.info("\n--- Suggerimenti Alternativi (basati sui tuoi ingredienti) ---")
         for nome, ingr_match in ricette_trovate.items():
-            logger.info(f"  > {nome} (usa: {', '.join(ingr_match)})")
+            logger.info(f"  > {nome} (usa: {', '.join(sorted(ingr_match))})")
         logger.info("Nota: Potresti aver bisogno di altri ingredienti per completarle.")
 
 
@@ -186,6 +245,27 @@ def cerca_ricette_parziali(lista_ingredienti):
 # 3️⃣ RETE BAYESIANA — STIMA DI SUCCESSO
 # ==============================================================================
 
+def _ottieni_rete_default():
+    """Ritorna la rete bayesiana di default, costruendola solo al primo utilizzo."""
+    global _default_rete
+    with _lock_rete:
+        if _default_rete is None:
+            _default_rete = rb.BayesianaRicette()
+    return _default_rete
+
+
+@lru_cache(maxsize=4)
+def _rete_appresa(dataset_path, mtime):
+    """
+    Apprende la rete dal dataset una sola volta per versione del file.
+    'mtime' fa parte della chiave di cache: se il CSV cambia, la rete viene riappresa.
+    """
+    dataset = rb.carica_dataset(dataset_path)
+    rete = rb.BayesianaRicette()
+    rete.impara_dataset(dataset, "bayes")
+    return rete
+
+
 def calcola_rischio_o_successo_ricetta(nome_ricetta, fatti):
     """
     Usa la rete bayesiana per stimare la probabilità di successo della ricetta.
@@ -195,7 +275,7 @@ def calcola_rischio_o_successo_ricetta(nome_ricetta, fatti):
 
     # Inizializza rete bayesiana
     try:
-        rete_bayesiana_temp = rb.BayesianaRicette()
+        rete_bayesiana_default = _ottieni_rete_default()
     except Exception as e:
         logger.error(f"Errore nella creazione della rete bayesiana: {e}")
         return "Valutazione non disponibile."
@@ -204,22 +284,20 @@ def calcola_rischio_o_successo_ricetta(nome_ricetta, fatti):
     evidenza = {}
     if 'tempo' in fatti:
         evidenza['Tempo'] = converti_tempo_in_indice(fatti['tempo'])
-    logger.debug(f"Evidenza per Rete Bayesiana: {evidenza}")
+    logger.debug("Evidenza per Rete Bayesiana: %s", evidenza)
 
     # Scelta modalità (1=default, 2=dataset)
     scelta_rete = ""
-    while scelta_rete not in ["1", "2"]:
+    while scelta_rete not in _MODALITA_RETE:
         print("\nVuoi affinare la stima usando il dataset (se disponibile)?")
         scelta_rete = input("(1) Usa stima di default\n(2) Usa stima con apprendimento da dataset\nRisposta: ").strip()
 
-    rete_da_usare = rete_bayesiana_temp
+    rete_da_usare = rete_bayesiana_default
 
     if scelta_rete == "2":
+        dataset_path = "src/ClassiSupporto/dataset_ricette.csv"
         try:
-            dataset_path = "src/ClassiSupporto/dataset_ricette.csv"
-            dataset = pd.read_csv(dataset_path)
-            rete_bayesiana_temp.impara_dataset(dataset, "bayes")
-            reteAggiornata = rete_bayesiana_temp
+            reteAggiornata = _rete_appresa(dataset_path, os.path.getmtime(dataset_path))
             rete_da_usare = reteAggiornata
             logger.info(f"Rete aggiornata con successo usando '{dataset_path}'")
         except FileNotFoundError:
@@ -229,12 +307,10 @@ def calcola_rischio_o_successo_ricetta(nome_ricetta, fatti):
 
     # Esegui inferenza
     try:
-        risultato = rb.ottieni_risultato_query(rete_da_usare.inferenza(evidenza))
-        p_successo = risultato["Successo"]
+        p_successo = rb.ottieni_risultato_query(rete_da_usare.inferenza(evidenza))
 
         try:
-            valore_successo = float(p_successo.iloc[1])     # ✅ Conversione sicura a float
-            probabilita_successo = valore_successo * 100
+            probabilita_successo = float(p_successo[1]) * 100     # ✅ P(Successo=1) come float
             return f"Probabilità di successo stimata: {round(probabilita_successo, 2)}%"
         except Exception as conv_err:
             logger.error(f"Valore non numerico per la probabilità di successo ({p_successo}). Dettagli: {conv_err}")
@@ -252,6 +328,20 @@ def calcola_rischio_o_successo_ricetta(nome_ricetta, fatti):
 # 4️⃣ FUNZIONI DI SUPPORTO
 # ==============================================================================
 
+def precarica_risorse():
+    """
+    Carica in anticipo l'ontologia e la rete bayesiana di default, così la prima
+    consulenza le trova già in memoria. Pensata per girare in un thread in background:
+    eventuali errori vengono solo registrati e si ripresentano al primo uso reale.
+    """
+    try:
+        _load_ontology(_ONTOLOGY_URI)
+        _ottieni_rete_default()._get_dag()
+        logger.debug("Ontologia e rete bayesiana precaricate.")
+    except Exception as e:
+        logger.debug("Precaricamento non riuscito: %s", e)
+
+
 def converti_tempo_in_categoria(minuti):
     """Converte i minuti in categorie 'poco', 'medio', 'molto'."""
     if minuti <= 20:
@@ -264,5 +354,4 @@ def converti_tempo_in_categoria(minuti):
 
 def converti_tempo_in_indice(categoria_tempo):
     """Converte la categoria tempo in un indice numerico per la rete bayesiana."""
-    mapping = {"poco": 0, "medio": 1, "molto": 2}
-    return mapping.get(categoria_tempo, 1)  # Default = medio
+    return _INDICE_TEMPO.get(categoria_tempo, 1)  # Default = medio
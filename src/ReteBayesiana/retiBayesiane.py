@@ -10,9 +10,14 @@
 # ==============================================================================
 
 import logging
+import math
+import os
+from functools import lru_cache
 from typing import Dict, Optional, List, Any
+import numpy as np
 import pandas as pd
 from pgmpy.factors.discrete import TabularCPD
+from pgmpy.inference import VariableElimination
 import bnlearn
 
 # ==============================================================================
@@ -23,6 +28,101 @@ if not logger.handlers:
     logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
 
+# ==============================================================================
+# Funzione helper: stringifica una colonna del dataset
+# ==============================================================================
+def _stringifica_colonna(serie: pd.Series) -> pd.Series:
+    """
+    Converte una colonna in stringhe ('0', '1', ...) con operazioni vettoriali.
+    Le colonne numeriche vengono troncate a intero; i NaN restano 'nan'.
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        testo = serie.fillna(0).astype('int64').astype(str)
+        return testo.where(serie.notna(), 'nan')
+    # Colonne miste/testuali: conversione cella per cella come in origine
+    return serie.apply(lambda v: str(int(v)) if pd.notna(v) and isinstance(v, (int, float)) else str(v))
+
+
+# ==============================================================================
+# Prior BDeu usato nell'apprendimento 'bayes'
+# ==============================================================================
+# Dimensione campionaria equivalente passata da bnlearn.parameter_learning.fit
+# al BayesianEstimator di pgmpy: ogni cella di una CPD riceve ESS / (n. celle).
+ESS_BDEU = 1000
+
+# Stato di 'Successo' -> colonna nei risultati di inferenza_batch
+_COLONNA_SUCCESSO = {'0': 0, '1': 1}
+
+
+# ==============================================================================
+# Funzione helper: conteggi congiunti degli stati
+# ==============================================================================
+def conta_stati(dataset: pd.DataFrame) -> pd.Series:
+    """
+    Conta quante volte compare ciascuna combinazione di stati nel dataset.
+    I valori vengono prima stringificati come in impara_dataset.
+    :return: Series indicizzata da un MultiIndex (una colonna per livello)
+    """
+    return dataset.apply(_stringifica_colonna).value_counts()
+
+
+# ==============================================================================
+# Funzione helper: caricamento del dataset con cache binaria
+# ==============================================================================
+def carica_dataset(percorso_csv: str) -> pd.DataFrame:
+    """
+    Carica il dataset CSV, riusando una copia binaria (.pkl) salvata accanto al file.
+    La copia viene rigenerata quando il CSV è più recente di essa.
+    :param percorso_csv: percorso del file CSV
+    :return: DataFrame con il contenuto del dataset
+    """
+    percorso_cache = os.path.splitext(percorso_csv)[0] + ".pkl"
+    mtime_csv = os.path.getmtime(percorso_csv)  # FileNotFoundError se il CSV manca
+
+    if os.path.exists(percorso_cache) and os.path.getmtime(percorso_cache) >= mtime_csv:
+        try:
+            return pd.read_pickle(percorso_cache)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache del dataset non leggibile ({percorso_cache}): {e}. Rileggo il CSV.")
+
+    dataset = pd.read_csv(percorso_csv)
+    try:
+        dataset.to_pickle(percorso_cache)
+    except OSError as e:
+        logger.debug("Impossibile salvare la cache del dataset in '%s': %s", percorso_cache, e)
+    return dataset
+
+
+# ==============================================================================
+# Funzione helper: tabella della CPD di Successo
+# ==============================================================================
+@lru_cache(maxsize=1)
+def _tabella_cpd_successo() -> np.ndarray:
+    """
+    Genera la CPD di Successo in base a regole euristiche, una sola volta per processo.
+    :return: array (2, 18) con le righe [fallimento, successo]; le colonne seguono
+             l'ordine (Tempo, Difficolta, QualitaIngredienti) atteso da TabularCPD
+    """
+    tempo, diff, qualita = np.meshgrid(np.arange(3), np.arange(3), np.arange(2), indexing='ij')
+
+    # penalizza se poco tempo e difficoltà alta
+    rischio = 0.3 * diff * (tempo == 0)
+    # penalizza la difficoltà
+    rischio = rischio + 0.5 * (diff == 2) + 0.2 * (diff == 1)
+    # penalizza la bassa qualità ingredienti
+    rischio = rischio + 0.4 * (qualita == 0)
+
+    # Limita rischio in [0.1, 0.95]
+    prob_successo = np.clip(1.0 - rischio, 0.1, 0.95).ravel()
+
+    # Tabella preallocata: riga 0 = fallimento, riga 1 = successo
+    tabella = np.empty((2, prob_successo.size), dtype=np.float64)
+    tabella[1] = prob_successo
+    np.subtract(1.0, prob_successo, out=tabella[0])
+    tabella.setflags(write=False)  # condivisa tra le istanze: sola lettura
+    return tabella
+
+
 # ==============================================================================
 # Classe BayesianaRicette
 # ==============================================================================
@@ -47,19 +147,37 @@ class BayesianaRicette:
             ('QualitaIngredienti', 'Successo')
         ]
 
+        # DAG e motore di inferenza, creati al primo utilizzo e riusati tra le query
+        self._dag = None
+        self._infer = None
+
         # Crea CPD di default
         self._create_default_cpd()
 
-        # Costruisce il DAG
-        try:
-            self.DAG = bnlearn.make_DAG(
-                self.Bordi,
-                CPD=[self.CPD_tempo, self.CPD_difficolta, self.CPD_qualita, self.CPD_successo],
-                verbose=0
-            )
-        except Exception as e:
-            logger.warning(f"⚠️ Impossibile creare DAG con CPD iniziali: {e}. Creo DAG vuoto.")
-            self.DAG = bnlearn.make_DAG(self.Bordi, verbose=0)
+    # --------------------------------------------------------------------------
+    # Costruzione (pigra) del DAG
+    # --------------------------------------------------------------------------
+    def _get_dag(self) -> dict:
+        """
+        Ritorna il DAG corrente, costruendolo con le CPD di default solo al primo
+        utilizzo. Se la rete è stata appresa da dataset, ritorna il DAG appreso.
+        """
+        if self._dag is None:
+            try:
+                self._dag = bnlearn.make_DAG(
+                    self.Bordi,
+                    CPD=[self.CPD_tempo, self.CPD_difficolta, self.CPD_qualita, self.CPD_successo],
+                    verbose=0
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Impossibile creare DAG con CPD iniziali: {e}. Creo DAG vuoto.")
+                self._dag = bnlearn.make_DAG(self.Bordi, verbose=0)
+        return self._dag
+
+    @property
+    def DAG(self) -> dict:
+        """DAG della rete (costruito al primo accesso)."""
+        return self._get_dag()
 
     # --------------------------------------------------------------------------
     # Creazione CPD di default
@@ -89,35 +207,11 @@ class BayesianaRicette:
             state_names={'QualitaIngredienti': ['0', '1']}
         )
 
-        # --- Genera la CPD di Successo in base a regole euristiche ---
-        def genera_cpd_successo():
-            valori = [[], []]  # [fallimento, successo]
-            for tempo in range(3):
-                for diff in range(3):
-                    for qualita in range(2):
-                        rischio = 0.0
-                        # penalizza se poco tempo e difficoltà alta
-                        if tempo == 0 and diff > 0:
-                            rischio += 0.3 * diff
-                        # penalizza la difficoltà
-                        if diff == 2:
-                            rischio += 0.5
-                        elif diff == 1:
-                            rischio += 0.2
-                        # penalizza la bassa qualità ingredienti
-                        if qualita == 0:
-                            rischio += 0.4
-
-                        # Limita rischio in [0.1, 0.95]
-                        prob_successo = max(0.1, min(0.95, 1.0 - rischio))
-                        valori[0].append(1 - prob_successo)  # fallimento
-                        valori[1].append(prob_successo)      # successo
-            return valori
-
+        # --- CPD di Successo dalla tabella euristica precalcolata ---
         self.CPD_successo = TabularCPD(
             variable='Successo',
             variable_card=2,
-            values=genera_cpd_successo(),
+            values=_tabella_cpd_successo(),
             evidence=['Tempo', 'Difficolta', 'QualitaIngredienti'],
             evidence_card=[3, 3, 2],
             state_names={
@@ -150,25 +244,79 @@ class BayesianaRicette:
         self.Bordi = [(c, 'Successo') for c in colonne if c != 'Successo']
 
         try:
-            self.DAG = bnlearn.make_DAG(self.Bordi, verbose=0)
+            struttura = bnlearn.make_DAG(self.Bordi, verbose=0)
         except Exception as e:
             logger.error(f"Errore nella creazione del DAG: {e}")
             raise
 
         # Converti i valori in stringhe (bnlearn usa categorie testuali)
-        df_learn = dataset.copy()
-        for col in df_learn.columns:
-            df_learn[col] = df_learn[col].apply(
-                lambda v: str(int(v)) if pd.notna(v) and isinstance(v, (int, float)) else str(v)
-            )
+        df_learn = dataset.apply(_stringifica_colonna)
 
         try:
-            self.DAG = bnlearn.parameter_learning.fit(self.DAG, df_learn, methodtype=metodo, verbose=0)
+            self._dag = bnlearn.parameter_learning.fit(struttura, df_learn, methodtype=metodo, verbose=0)
+            self._infer = None  # il DAG è cambiato: il motore va ricreato
             logger.info("✅ Parametri della rete bayesiana aggiornati con successo.")
         except Exception as e:
             logger.error(f"❌ Errore durante il parameter learning: {e}")
             raise
 
+    # --------------------------------------------------------------------------
+    # Apprendimento da conteggi (prior BDeu)
+    # --------------------------------------------------------------------------
+    def impara_da_conteggi(self, conteggi: pd.Series, ess: float = ESS_BDEU) -> None:
+        """
+        Stima le CPD direttamente dai conteggi congiunti (vedi conta_stati), con lo
+        stesso prior BDeu dell'apprendimento 'bayes'. Permette di aggiornare la rete
+        sommando/sottraendo conteggi senza ripassare sulle righe del dataset.
+        :param conteggi: Series con MultiIndex di stati (stringhe) -> numero di righe
+        :param ess: dimensione campionaria equivalente del prior
+        """
+        conteggi = conteggi[conteggi > 0]
+        if conteggi.empty:
+            raise ValueError("❌ Nessun conteggio positivo: impossibile stimare le CPD")
+
+        colonne = list(conteggi.index.names)
+        self.Bordi = [(c, 'Successo') for c in colonne if c != 'Successo']
+
+        # Stati osservati per ciascuna variabile (ordinati, come fa pgmpy)
+        stati = {c: sorted(conteggi.index.get_level_values(c).unique()) for c in colonne}
+
+        cpds = []
+        for variabile in colonne:
+            genitori = sorted(p for p, figlio in self.Bordi if figlio == variabile)
+            livelli = [variabile] + genitori
+
+            # Tabella completa (stati mai osservati insieme -> 0), righe = variabile
+            if genitori:
+                indice = pd.MultiIndex.from_product([stati[v] for v in livelli], names=livelli)
+                tabella = conteggi.groupby(level=livelli).sum().reindex(indice, fill_value=0)
+            else:
+                indice = pd.Index(stati[variabile], name=variabile)
+                tabella = conteggi.groupby(level=variabile).sum().reindex(indice, fill_value=0)
+            tabella = tabella.to_numpy(dtype=np.float64).reshape(len(stati[variabile]), -1)
+
+            # Prior BDeu e normalizzazione per colonna; l'ultima riga è il complemento
+            # delle altre, così ogni colonna somma esattamente a 1 (niente avvisi di bnlearn)
+            tabella += ess / tabella.size
+            tabella /= tabella.sum(axis=0, keepdims=True)
+            tabella[-1] = 1.0 - tabella[:-1].sum(axis=0)
+
+            cpds.append(TabularCPD(
+                variable=variabile,
+                variable_card=len(stati[variabile]),
+                values=tabella,
+                evidence=genitori or None,
+                evidence_card=[len(stati[g]) for g in genitori] or None,
+                state_names={v: stati[v] for v in livelli}
+            ))
+
+        try:
+            self._dag = bnlearn.make_DAG(self.Bordi, CPD=cpds, verbose=0)
+            self._infer = None  # il DAG è cambiato: il motore va ricreato
+        except Exception as e:
+            logger.error(f"❌ Errore nella creazione del DAG dai conteggi: {e}")
+            raise
+
     # --------------------------------------------------------------------------
     # Inferenza sul nodo Successo
     # --------------------------------------------------------------------------
@@ -181,20 +329,23 @@ class BayesianaRicette:
         if not isinstance(evidenze, dict):
             raise ValueError("L'argomento 'evidenze' deve essere un dizionario")
 
-        # Converte tutti i valori in stringhe (per compatibilità con bnlearn)
-        evidenze_ok = {}
-        for k, v in evidenze.items():
-            if pd.isna(v):
-                continue
-            evidenze_ok[k] = str(int(v)) if isinstance(v, (int, float)) else str(v)
+        # Converte tutti i valori in stringhe (per compatibilità con bnlearn),
+        # lasciando invariati quelli già normalizzati e scartando i mancanti
+        evidenze_ok = {
+            k: v if type(v) is str else (str(int(v)) if isinstance(v, (int, float)) else str(v))
+            for k, v in evidenze.items()
+            if v is not None and v is not pd.NA and not (isinstance(v, float) and math.isnan(v))
+        }
 
         try:
-            # Esegui inferenza bayesiana
-            query = bnlearn.inference.fit(
-                self.DAG,
+            # Esegui inferenza bayesiana (Variable Elimination riusata tra le chiamate)
+            if self._infer is None:
+                self._infer = VariableElimination(self._get_dag()['model'])
+            query = self._infer.query(
                 variables=['Successo'],
                 evidence=evidenze_ok,
-                verbose=0
+                joint=False,
+                show_progress=False
             )
 
             # Estrai il fattore di probabilità del nodo "Successo"
@@ -212,29 +363,67 @@ class BayesianaRicette:
 
             # Stampa probabilità se disponibili
             if hasattr(factor, 'values') and len(factor.values) >= 2:
-                logger.info(f"P(Successo=0)={factor.values[0]:.3f}, P(Successo=1)={factor.values[1]:.3f}")
+                logger.info("P(Successo=0)=%.3f, P(Successo=1)=%.3f", factor.values[0], factor.values[1])
 
             return factor
 
         except Exception as e:
-            logger.error(f"❌ Errore durante l'inferenza (bnlearn): {e}")
-            logger.debug(f"Evidenze passate (stringify): {evidenze_ok}")
+            logger.error(f"❌ Errore durante l'inferenza (pgmpy): {e}")
+            logger.debug("Evidenze passate (stringify): %s", evidenze_ok)
             raise
 
 
+    # --------------------------------------------------------------------------
+    # Inferenza in blocco su più righe di evidenze
+    # --------------------------------------------------------------------------
+    def inferenza_batch(self, df_evidenze: pd.DataFrame) -> np.ndarray:
+        """
+        Esegue l'inferenza su 'Successo' per ogni riga di un DataFrame di evidenze.
+        Le righe con la stessa combinazione di evidenze condividono un'unica query:
+        con domini discreti le combinazioni distinte sono poche (al più 18 qui).
+        :param df_evidenze: DataFrame con una colonna per ciascuna variabile osservata
+        :return: array (n_righe, 2) con [P(Successo=0), P(Successo=1)];
+                 NaN per le righe la cui inferenza è fallita
+        """
+        if not isinstance(df_evidenze, pd.DataFrame):
+            raise ValueError("❌ Le evidenze devono essere un pandas.DataFrame")
+
+        colonne = list(df_evidenze.columns)
+
+        # Raggruppa le righe per combinazione di evidenze (ordine di prima apparizione)
+        combinazioni = {}
+        inverse = np.array(
+            [combinazioni.setdefault(riga, len(combinazioni))
+             for riga in df_evidenze.itertuples(index=False, name=None)],
+            dtype=np.intp
+        )
+
+        # Una sola inferenza per combinazione distinta
+        risultati = np.full((len(combinazioni), 2), np.nan)
+        for riga, pos in combinazioni.items():
+            try:
+                factor = self.inferenza(dict(zip(colonne, riga)))
+            except Exception:
+                continue
+            # Solo gli stati '0'/'1' hanno una colonna; altri stati (es. 'nan') si ignorano
+            stati = factor.state_names.get('Successo', ['0', '1'])
+            for stato, valore in zip(stati, factor.values):
+                colonna = _COLONNA_SUCCESSO.get(str(stato))
+                if colonna is not None:
+                    risultati[pos, colonna] = valore
+            # Uno stato mai osservato in apprendimento ha probabilità nulla
+            risultati[pos, np.isnan(risultati[pos])] = 0.0
+
+        return risultati[inverse]
+
+
 # ==============================================================================
-# Funzione helper: converte il risultato in DataFrame
+# Funzione helper: estrae le probabilità dal risultato
 # ==============================================================================
-def ottieni_risultato_query(query) -> pd.DataFrame:
+def ottieni_risultato_query(query) -> np.ndarray:
     """
-    Converte il risultato di bnlearn.inference.fit in un DataFrame leggibile.
+    Estrae dal risultato dell'inferenza le probabilità di 'Successo' come array NumPy,
+    nell'ordine degli stati ('0', '1'), senza costruire un DataFrame.
     """
-    try:
-        return bnlearn.bnlearn.query2df(query, verbose=0)
-    except Exception:
-        try:
-            if isinstance(query, dict) and 'Successo' in query and hasattr(query['Successo'], 'df'):
-                return query['Successo'].df
-        except Exception:
-            pass
-    return pd.DataFrame()
+    factor = query['Successo'] if isinstance(query, dict) else query
+    return np.asarray(factor.values)
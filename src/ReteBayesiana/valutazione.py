@@ -9,24 +9,30 @@
 #   - Esegue una K-Fold Cross Validation
 #   - Addestra e valuta la rete bayesiana su ciascun fold
 #   - Calcola e stampa metriche (Accuracy, Precision, Recall, F1)
-#   - Salva i risultati in formato CSV e JSON
+#   - Salva i risultati in formato CSV, JSONL (per fold) e JSON (riepilogo)
 # ==============================================================================
 
 import os
+import csv
 import json
+import hashlib
+import inspect
 import logging
+import tempfile
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
+from joblib import Memory, Parallel, delayed
 from sklearn.model_selection import KFold
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 
 # ==============================================================================
 # Import della rete bayesiana
 # ==============================================================================
 try:
-    from retiBayesiane import BayesianaRicette
+    import retiBayesiane
+    from retiBayesiane import BayesianaRicette, ESS_BDEU, carica_dataset, conta_stati
 except ImportError:
     print("❌ ERRORE: impossibile importare 'BayesianaRicette' da retiBayesiane.py")
     exit(1)
@@ -40,14 +46,16 @@ logger = logging.getLogger("valutazione")
 # ==============================================================================
 # Caricamento Dataset
 # ==============================================================================
-dataset_path = r"C:\sviluppo\ICON_DanieleChiarazzo\src\ClassiSupporto\dataset_ricette.csv"
+dataset_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "ClassiSupporto", "dataset_ricette.csv"
+)
 
 if not os.path.exists(dataset_path):
     logger.error(f"❌ File non trovato: {dataset_path}")
     exit(1)
 
 try:
-    df = pd.read_csv(dataset_path)
+    df = carica_dataset(dataset_path)
     logger.info(f"✅ Dataset caricato con successo ({df.shape[0]} righe, {df.shape[1]} colonne)")
 except Exception as e:
     logger.error(f"Errore durante la lettura del CSV: {e}")
@@ -73,28 +81,68 @@ DOMINI = {
     'Successo': [0, 1]
 }
 
+# Metriche calcolate per ciascun fold
+NOMI_METRICHE = ("Accuracy", "Precision", "Recall", "F1")
+
 # ==============================================================================
 # Preparazione Dati
 # ==============================================================================
 X_data = df.drop('Successo', axis=1)
 y_data = df['Successo']
 
+# Tipi compatti prima della CV: interi ridotti (es. int8) e 'category' per le colonne
+# testuali, così slicing, unique e hashing lavorano su dati più piccoli in ogni fold
+for col in X_data.columns:
+    if pd.api.types.is_numeric_dtype(X_data[col]):
+        X_data[col] = pd.to_numeric(X_data[col], downcast="integer")
+    else:
+        X_data[col] = X_data[col].astype("category")
+y_data = pd.to_numeric(y_data, downcast="integer")
+
 # ==============================================================================
 # Impostazione K-Fold Cross Validation
 # ==============================================================================
 N_SPLITS = 10 if len(df) >= 10 else len(df)
 kf = KFold(n_splits=N_SPLITS, shuffle=True, random_state=42)
 
-# Liste metriche globali
-fold_metrics = []
-accuracies, precisions, recalls, f1s = [], [], [], []
+# ==============================================================================
+# Cache su disco dei modelli addestrati
+# ==============================================================================
+# I modelli di ciascun fold restano in '.cv_cache' (accanto allo script) e vengono riletti nelle
+# esecuzioni successive finché non cambiano i dati del fold, ESS_BDEU o il
+# codice di apprendimento in retiBayesiane.py (impronta del sorgente del modulo)
+memoria_cv = Memory(location=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cv_cache"), verbose=0)
+VERSIONE_MODELLO_CV = hashlib.sha1(inspect.getsource(retiBayesiane).encode("utf-8")).hexdigest()
+
+
+@memoria_cv.cache
+def _addestra_da_conteggi(conteggi_fold, ess, versione_modello):
+    """Rete del fold appresa dai conteggi congiunti (la chiave è la Series stessa)."""
+    bn_model = BayesianaRicette()
+    bn_model.impara_da_conteggi(conteggi_fold, ess=ess)
+    return bn_model
+
+
+@memoria_cv.cache(ignore=["train_data_fold"])
+def _addestra_da_dataset(hash_train_data_fold, train_data_fold, ess, versione_modello):
+    """Rete del fold appresa dalle righe; la chiave è solo l'hash del DataFrame."""
+    bn_model = BayesianaRicette()
+    bn_model.impara_dataset(train_data_fold, metodo="bayes")
+    return bn_model
 
-logger.info(f"🚀 Avvio della Cross-Validation ({N_SPLITS} fold)...")
 
 # ==============================================================================
-# Loop sui Fold
+# Valutazione di un singolo Fold
 # ==============================================================================
-for fold, (train_index, test_index) in enumerate(kf.split(X_data)):
+def _run_fold(fold, train_index, test_index, X_data, y_data, domini, conteggi_completi):
+    """
+    Addestra e valuta la rete bayesiana su un singolo fold.
+    Ritorna un dizionario con le metriche del fold, oppure None se non ci sono
+    predizioni valide. Riceve tutti i dati come argomenti: ogni fold è indipendente
+    e può girare in un processo separato.
+    I parametri del fold si ottengono dai conteggi dell'intero dataset togliendo
+    quelli del test set (e aggiungendo le righe fittizie), senza riaddestrare da zero.
+    """
     logger.info(f"--- Fold {fold + 1}/{N_SPLITS} ---")
 
     X_train, X_test = X_data.iloc[train_index], X_data.iloc[test_index]
@@ -104,123 +152,200 @@ for fold, (train_index, test_index) in enumerate(kf.split(X_data)):
     train_data_fold = pd.concat([X_train, y_train.rename('Successo')], axis=1)
 
     # 🔹 Aggiungi stati mancanti per garantire copertura completa
-    for col, stati_possibili in DOMINI.items():
-        valori_presenti = train_data_fold[col].unique().tolist()
+    #    (le righe fittizie vengono raccolte e accodate con un unico concat)
+    prima_riga = {c: train_data_fold[c].iloc[0] for c in train_data_fold.columns}
+    dummies = []
+    for col, stati_possibili in domini.items():
+        valori_presenti = set(train_data_fold[col].unique())
         mancanti = [v for v in stati_possibili if v not in valori_presenti]
         if mancanti:
             for val in mancanti:
-                dummy_row = {c: train_data_fold[c].iloc[0] for c in train_data_fold.columns}
+                dummy_row = dict(prima_riga)
                 dummy_row[col] = val
-                train_data_fold = pd.concat([train_data_fold, pd.DataFrame([dummy_row])], ignore_index=True)
+                dummies.append(dummy_row)
             logger.info(f"📊 Aggiunti stati mancanti per '{col}': {mancanti}")
 
+    df_dummies = pd.DataFrame.from_records(dummies, columns=train_data_fold.columns)
+
     # ==============================================================================
     # Addestramento Rete
     # ==============================================================================
-    bn_model = BayesianaRicette()
-    bn_model.impara_dataset(train_data_fold, metodo="bayes")
+    try:
+        # conteggi(train) = conteggi(tutto) - conteggi(test) + conteggi(righe fittizie)
+        test_data_fold = pd.concat([X_test, y_test_true.rename('Successo')], axis=1)
+        conteggi_fold = conteggi_completi.sub(conta_stati(test_data_fold), fill_value=0)
+        if dummies:
+            conteggi_fold = conteggi_fold.add(conta_stati(df_dummies), fill_value=0)
+        bn_model = _addestra_da_conteggi(conteggi_fold, ESS_BDEU, VERSIONE_MODELLO_CV)
+    except Exception as e:
+        # Fallback: riaddestramento completo sulle righe del fold
+        logger.warning(f"⚠️ Aggiornamento dai conteggi non riuscito nel fold {fold + 1}: {e}. Riaddestro.")
+        train_data_fold = pd.concat([train_data_fold, df_dummies], ignore_index=True)
+        hash_train = (tuple(train_data_fold.columns), len(train_data_fold),
+                      int(pd.util.hash_pandas_object(train_data_fold, index=False).sum()))
+        bn_model = _addestra_da_dataset(hash_train, train_data_fold, ESS_BDEU, VERSIONE_MODELLO_CV)
 
     # ==============================================================================
     # Inferenza
     # ==============================================================================
-    y_pred_list = []
-
-    for i, test_row in X_test.iterrows():
-        evidenza = test_row.to_dict()
-        try:
-            query_result = bn_model.inferenza(dati=evidenza)
-            prob_values = query_result.values
-
-            # Probabilità di Successo=1
-            prob_successo_1 = 0.0
-            if len(prob_values) == 2:
-                prob_successo_1 = prob_values[1]
-            elif len(prob_values) == 1:
-                prob_successo_1 = 0.0 if '0' in query_result.state_names.get('Successo', []) else 1.0
-
-            predizione = int(prob_successo_1 >= 0.5)
-            y_pred_list.append(predizione)
-
-            logger.info(
-                f"🔹 Test {i}: evidenza={evidenza} → "
-                f"P(Successo=1)={prob_successo_1:.2f} → pred={predizione}"
+    # P(Successo=1 | e) si calcola una volta per ogni combinazione di evidenze presente
+    # nel test set del fold; le righe di test diventano semplici lookup
+    combinazioni_test = X_test.drop_duplicates()
+    pred_lookup = dict(zip(combinazioni_test.itertuples(index=False, name=None),
+                           bn_model.inferenza_batch(combinazioni_test)[:, 1]))
+    prob_successo = np.fromiter(
+        (pred_lookup.get(riga, np.nan) for riga in X_test.itertuples(index=False, name=None)),
+        dtype=float, count=len(X_test)
+    )
+    y_pred = np.where(np.isnan(prob_successo), np.nan, (prob_successo >= 0.5).astype(float))
+
+    n_errori = int(np.isnan(y_pred).sum())
+    if n_errori:
+        logger.error(f"Errore durante l'inferenza nel fold {fold + 1}: {n_errori} test senza predizione")
+
+    # Dettaglio per test: costruito solo se il livello INFO è attivo, emesso in un unico messaggio
+    if logger.isEnabledFor(logging.INFO):
+        colonne_test = X_test.columns.tolist()
+        righe_test = X_test.itertuples(index=False, name=None)
+        messaggi = []
+        for i, riga, prob_successo_1, predizione in zip(X_test.index, righe_test, prob_successo, y_pred):
+            if np.isnan(predizione):
+                continue
+            evidenza = dict(zip(colonne_test, riga))
+            messaggi.append(
+                "🔹 Test %s: evidenza=%s → P(Successo=1)=%.2f → pred=%d"
+                % (i, evidenza, prob_successo_1, predizione)
             )
-
-        except Exception as e:
-            logger.error(f"Errore durante l'inferenza nel fold {fold + 1}: {e}")
-            y_pred_list.append(np.nan)
+        if messaggi:
+            logger.info("\n".join(messaggi))
 
     # ==============================================================================
     # Calcolo Metriche
     # ==============================================================================
-    y_test_clean = [y for i, y in enumerate(y_test_true) if not np.isnan(y_pred_list[i])]
-    y_pred_clean = [y for y in y_pred_list if not np.isnan(y)]
-
-    if len(y_pred_clean) > 0:
-        acc = accuracy_score(y_test_clean, y_pred_clean)
-        prec = precision_score(y_test_clean, y_pred_clean, pos_label=1, zero_division=0)
-        rec = recall_score(y_test_clean, y_pred_clean, pos_label=1, zero_division=0)
-        f1 = f1_score(y_test_clean, y_pred_clean, pos_label=1, zero_division=0)
-
-        accuracies.append(acc)
-        precisions.append(prec)
-        recalls.append(rec)
-        f1s.append(f1)
-
-        fold_metrics.append({
-            "Fold": fold + 1,
-            "Accuracy": round(acc, 3),
-            "Precision": round(prec, 3),
-            "Recall": round(rec, 3),
-            "F1": round(f1, 3)
-        })
-    else:
-        logger.warning(f"⚠️ Nessuna predizione valida per il fold {fold + 1}.")
+    maschera_valide = ~np.isnan(y_pred)
+    y_test_clean = y_test_true.to_numpy()[maschera_valide]
+    y_pred_clean = y_pred[maschera_valide].astype(int)
+
+    if len(y_pred_clean) == 0:
+        return None
+
+    # Precision, Recall e F1 con un'unica passata sulla matrice di confusione
+    acc = accuracy_score(y_test_clean, y_pred_clean)
+    prec, rec, f1, _ = precision_recall_fscore_support(
+        y_test_clean, y_pred_clean, pos_label=1, average="binary", zero_division=0
+    )
+
+    return {"Fold": fold + 1, **dict(zip(NOMI_METRICHE, (acc, prec, rec, f1)))}
+
+
+# ==============================================================================
+# Percorsi di Salvataggio
+# ==============================================================================
+# Cartella base configurabile con CV_OUT; ogni esecuzione scrive in una sottocartella
+# propria (per timestamp), così esecuzioni parallele non si sovrascrivono
+output_dir = os.environ.get("CV_OUT", os.path.join(tempfile.gettempdir(), "cv_out"))
+timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+run_dir = os.path.join(output_dir, timestamp)
+os.makedirs(run_dir, exist_ok=True)
+
+csv_path = os.path.join(run_dir, f"valutazione_{timestamp}.csv")
+json_path = os.path.join(run_dir, f"valutazione_{timestamp}.json")
+jsonl_path = os.path.join(run_dir, f"valutazione_{timestamp}.jsonl")
+
+# ==============================================================================
+# Esecuzione parallela dei Fold
+# ==============================================================================
+# Conteggi congiunti dell'intero dataset, calcolati una sola volta per tutti i fold
+conteggi_completi = conta_stati(pd.concat([X_data, y_data.rename('Successo')], axis=1))
+
+# Un processo per fold, senza superare i core disponibili
+N_JOBS = min(N_SPLITS, os.cpu_count() or 1)
+
+logger.info(f"🚀 Avvio della Cross-Validation ({N_SPLITS} fold, {N_JOBS} processi)...")
+
+
+def _risultati_a_blocchi(suddivisioni):
+    """
+    Esegue i fold a blocchi di N_JOBS (joblib 1.1 non supporta return_as="generator")
+    e ritorna i risultati in ordine di fold, un blocco alla volta: il ciclo di scrittura
+    salva i fold di ogni blocco prima che parta il successivo.
+    """
+    with Parallel(n_jobs=N_JOBS, backend="loky") as parallel:
+        for inizio in range(0, len(suddivisioni), N_JOBS):
+            yield from parallel(
+                delayed(_run_fold)(fold, train_index, test_index, X_data, y_data, DOMINI, conteggi_completi)
+                for fold, (train_index, test_index) in suddivisioni[inizio:inizio + N_JOBS]
+            )
+
+
+risultati_fold = _risultati_a_blocchi(list(enumerate(kf.split(X_data))))
+
+# Accumulatori per media e deviazione standard: somma, somma dei quadrati e numero di fold
+# (un vettore per tutte le metriche, nell'ordine di NOMI_METRICHE)
+somme = np.zeros(len(NOMI_METRICHE), dtype=np.float64)
+somme_quadrati = np.zeros(len(NOMI_METRICHE), dtype=np.float64)
+n_fold_validi = 0
+
+# I fold vengono scritti su disco al termine di ciascun blocco (JSONL e CSV in append)
+with open(jsonl_path, "a", encoding="utf-8") as f_jsonl, \
+        open(csv_path, "w", encoding="utf-8", newline="") as f_csv:
+    writer_csv = csv.DictWriter(f_csv, fieldnames=("Fold",) + NOMI_METRICHE)
+    writer_csv.writeheader()
+
+    for fold, metriche in enumerate(risultati_fold):
+        if metriche is None:
+            logger.warning(f"⚠️ Nessuna predizione valida per il fold {fold + 1}.")
+            continue
+
+        valori = np.array([metriche[nome] for nome in NOMI_METRICHE], dtype=np.float64)
+        n_fold_validi += 1
+        somme += valori
+        somme_quadrati += valori ** 2
+
+        # Le metriche restano float grezzi: l'arrotondamento serve solo nei file
+        fold_record = {"Fold": metriche["Fold"],
+                       **{nome: round(metriche[nome], 3) for nome in NOMI_METRICHE}}
+        f_jsonl.write(json.dumps(fold_record) + "\n")
+        writer_csv.writerow(fold_record)
+        f_jsonl.flush()
+        f_csv.flush()
 
 # ==============================================================================
 # Risultati Finali
 # ==============================================================================
-media_acc = np.mean(accuracies) if accuracies else 0
-media_prec = np.mean(precisions) if precisions else 0
-media_rec = np.mean(recalls) if recalls else 0
-media_f1 = np.mean(f1s) if f1s else 0
+# Media e deviazione standard di tutte le metriche con un'unica operazione vettoriale
+if n_fold_validi:
+    vettore_medie = somme / n_fold_validi
+    # np.maximum(..., 0) assorbe piccoli valori negativi dovuti all'arrotondamento
+    vettore_dev = np.sqrt(np.maximum(somme_quadrati / n_fold_validi - vettore_medie ** 2, 0.0))
+else:
+    vettore_medie = np.zeros(len(NOMI_METRICHE))
+    vettore_dev = np.full(len(NOMI_METRICHE), np.nan)
+
+medie = dict(zip(NOMI_METRICHE, vettore_medie.tolist()))
+deviazioni = dict(zip(NOMI_METRICHE, vettore_dev.tolist()))
 
 print("\n" + "=" * 60)
 print("--- Risultati Finali della Cross-Validation ---")
-print(f"🎯 Accuracy:  {media_acc:.2f} ± {np.std(accuracies):.2f}")
-print(f"🎯 Precision: {media_prec:.2f} ± {np.std(precisions):.2f}")
-print(f"🎯 Recall:    {media_rec:.2f} ± {np.std(recalls):.2f}")
-print(f"🎯 F1-Score:  {media_f1:.2f} ± {np.std(f1s):.2f}")
+print(f"🎯 Accuracy:  {medie['Accuracy']:.2f} ± {deviazioni['Accuracy']:.2f}")
+print(f"🎯 Precision: {medie['Precision']:.2f} ± {deviazioni['Precision']:.2f}")
+print(f"🎯 Recall:    {medie['Recall']:.2f} ± {deviazioni['Recall']:.2f}")
+print(f"🎯 F1-Score:  {medie['F1']:.2f} ± {deviazioni['F1']:.2f}")
 print("=" * 60)
 
 # ==============================================================================
-# Salvataggio Risultati
+# Salvataggio Riepilogo
 # ==============================================================================
-output_dir = r"C:\sviluppo\ICON_DanieleChiarazzo\risultati"
-os.makedirs(output_dir, exist_ok=True)
-
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-csv_path = os.path.join(output_dir, f"valutazione_{timestamp}.csv")
-json_path = os.path.join(output_dir, f"valutazione_{timestamp}.json")
-
-# --- CSV ---
-df_risultati = pd.DataFrame(fold_metrics)
-df_risultati.to_csv(csv_path, index=False)
-
-# --- JSON ---
+# I singoli fold sono già nel file JSONL: il JSON contiene solo il riepilogo
 risultato_completo = {
-    "media": {
-        "Accuracy": round(media_acc, 3),
-        "Precision": round(media_prec, 3),
-        "Recall": round(media_rec, 3),
-        "F1": round(media_f1, 3)
-    },
-    "folds": fold_metrics
+    "media": {nome: round(valore, 3) for nome, valore in medie.items()},
+    "n_fold": n_fold_validi,
+    "folds": os.path.basename(jsonl_path)
 }
 with open(json_path, "w", encoding="utf-8") as f:
     json.dump(risultato_completo, f, indent=4)
 
-logger.info(f"📁 Risultati salvati in:\n - CSV:  {csv_path}\n - JSON: {json_path}")
+logger.info(f"📁 Risultati salvati in:\n - CSV:   {csv_path}\n - JSON:  {json_path}\n - JSONL: {jsonl_path}")
 
 print("\n✅ Valutazione completata. "
       "Puoi ora inserire i risultati nella Sezione 4.4 della tua relazione 📘")
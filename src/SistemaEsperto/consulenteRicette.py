@@ -7,12 +7,21 @@
 # ==============================================================================
 
 import logging
+import sys
 from experta import *
 from src.ClassiSupporto import interfacciaConUtente 
 
 #  Ottieni un'istanza del logger per questo file ---
 logger = logging.getLogger(__name__)
 
+# Risposte ammesse alle domande s/n
+_SI_NO = frozenset({'s', 'n'})
+
+# Ingredienti richiesti da ciascuna regola 'suggerisci_*'
+_INGREDIENTI_PASTA_POMODORO = frozenset({"pasta", "pomodoro"})
+_INGREDIENTI_UOVA_STRAPAZZATE = frozenset({"uova"})
+_INGREDIENTI_INSALATA = frozenset({"lattuga", "pomodoro"})
+
 # ==============================================================================
 # Classe ConsulenteRicette
 # Implementa il motore del sistema esperto.
@@ -21,6 +30,21 @@ class ConsulenteRicette(KnowledgeEngine):
 
     # ... (le prime 4 regole 'DefFacts', 'chiedi_ingredienti', 'chiedi_tempo', 'chiedi_preferenze' sono invariate) ...
 
+    def __init__(self):
+        super().__init__()
+        self._azzera_indici()
+
+    def reset(self, **kwargs):
+        self._azzera_indici()
+        super().reset(**kwargs)
+
+    def _azzera_indici(self):
+        # Copie dei fatti 'candidato' e 'ingredienti', aggiornate quando vengono dichiarati:
+        # evitano di scorrere tutta la memoria di lavoro (self.facts) per ritrovarli.
+        # Ogni candidato è associato al numero di ingredienti richiesti dalla sua regola
+        self._candidati = {}
+        self._ingredienti = []
+
     @DefFacts()
     def _initial_action(self):
         yield Fact(azione="chiediIngredienti")
@@ -35,8 +59,10 @@ class ConsulenteRicette(KnowledgeEngine):
             self.declare(Fact(azione="termina"))
             return
             
-        for ingrediente in ingredienti_utente:
-            self.declare(Fact(ingrediente=ingrediente.strip().lower()))
+        # Ordine di inserimento, senza duplicati (serve alla ricerca parziale)
+        self._ingredienti = list(dict.fromkeys(ing.strip().lower() for ing in ingredienti_utente))
+        # Un unico fatto con tutti gli ingredienti: le regole li confrontano come insieme
+        self.declare(Fact(ingredienti=frozenset(self._ingredienti)))
             
         self.declare(Fact(azione="chiediTempo"))
 
@@ -60,90 +86,120 @@ class ConsulenteRicette(KnowledgeEngine):
     # --------------------------------------------------------------------------
 
     @Rule(Fact(azione="trovaRicetta"),
-          Fact(ingrediente="pasta"),
-          Fact(ingrediente="pomodoro"),
+          Fact(ingredienti=MATCH.ing),
+          TEST(lambda ing: _INGREDIENTI_PASTA_POMODORO <= ing),
           OR(Fact(tempo_disponibile="medio"),
              Fact(tempo_disponibile="molto")),
           salience=1) 
     def suggerisci_pasta_pomodoro(self):
         logger.debug("Trovato candidato: Pasta al Pomodoro")
-        self.declare(Fact(candidato="Pasta al Pomodoro")) 
+        self.declare(Fact(candidato="Pasta al Pomodoro"))
+        self._candidati["Pasta al Pomodoro"] = len(_INGREDIENTI_PASTA_POMODORO)
 
     @Rule(Fact(azione="trovaRicetta"),
-          Fact(ingrediente="uova"),
+          Fact(ingredienti=MATCH.ing),
+          TEST(lambda ing: _INGREDIENTI_UOVA_STRAPAZZATE <= ing),
           Fact(tempo_disponibile="poco"), 
           salience=1)
     def suggerisci_uova_strapazzate(self):
         logger.debug("Trovato candidato: Uova Strapazzate")
         self.declare(Fact(candidato="Uova Strapazzate"))
+        self._candidati["Uova Strapazzate"] = len(_INGREDIENTI_UOVA_STRAPAZZATE)
 
     @Rule(Fact(azione="trovaRicetta"),
-          Fact(ingrediente="lattuga"),
-          Fact(ingrediente="pomodoro"),
+          Fact(ingredienti=MATCH.ing),
+          TEST(lambda ing: _INGREDIENTI_INSALATA <= ing),
           Fact(tempo_disponibile="poco"),
           salience=1)
     def suggerisci_insalata(self):
         logger.debug("Trovato candidato: Insalata Mista")
         self.declare(Fact(candidato="Insalata Mista"))
+        self._candidati["Insalata Mista"] = len(_INGREDIENTI_INSALATA)
         
+    # --------------------------------------------------------------------------
+    # VERIFICA DEI CANDIDATI (Priorità 0.7) ---
+    # Gira dopo tutte le regole 'suggerisci_*' e dichiara un fatto esplicito
+    # sull'esito, così le regole successive usano un semplice confronto positivo
+    # --------------------------------------------------------------------------
+    @Rule(Fact(azione="trovaRicetta"), salience=0.7)
+    def verifica_candidati(self):
+        if self._candidati:
+            self.declare(Fact(has_candidati=True))
+        else:
+            self.declare(Fact(no_candidati=True))
+
     # --------------------------------------------------------------------------
     #  NUOVA REGOLA PER SCEGLIERE TRA I CANDIDATI (Priorità 0.5) ---
     # Si attiva solo se almeno un candidato è stato trovato.
     # --------------------------------------------------------------------------
     @Rule(Fact(azione="trovaRicetta"),
-          Fact(candidato=W()), # Si attiva solo se esiste almeno un candidato
+          Fact(has_candidati=True), # Si attiva solo se esiste almeno un candidato
           salience=0.5)
     def scegli_candidati(self):
-        # Raccogli tutti i candidati unici
-        candidati = set()
-        for fact in self.facts.values():
-            if 'candidato' in fact:
-                candidati.add(fact['candidato'])
-        
-        candidati_lista = list(candidati)
-        
+        ricetta_scelta = self._select_candidato()
+
+        # Dichiara la ricetta scelta per far partire la valutazione
+        self.declare(Fact(ricetta_suggerita=ricetta_scelta))
+        self.declare(Fact(azione="valutaRicetta"))
+
+    def _rank_candidati(self, candidati_lista):
+        """
+        Sceglie un candidato senza interazione: vince la ricetta che richiede più
+        ingredienti (la più specifica), a parità quella con il nome minore.
+        """
+        return min(candidati_lista, key=lambda nome: (-self._candidati.get(nome, 0), nome))
+
+    def _select_candidato(self):
+        """
+        Ritorna la ricetta scelta tra i candidati. Chiede all'utente solo se ci sono
+        più candidati e si è su un terminale interattivo; altrimenti usa _rank_candidati.
+        """
+        # Candidati unici raccolti dalle regole 'suggerisci_*', dal più specifico
+        candidati_lista = sorted(self._candidati, key=lambda nome: (-self._candidati[nome], nome))
+
         if len(candidati_lista) == 1:
             # --- Se c'è solo un candidato, sceglilo automaticamente ---
             ricetta_scelta = candidati_lista[0]
             logger.info(f"\nHo trovato un'unica ricetta che corrisponde ai tuoi criteri: {ricetta_scelta}")
-        else:
-            # --- Se ci sono più candidati, fai scegliere l'utente ---
-            logger.info("\nHo trovato più ricette che corrispondono ai tuoi criteri:")
-            for i, nome in enumerate(candidati_lista):
-                print(f"({i+1}) {nome}") # Usiamo print per l'interazione
-            
-            scelta = 0
-            while scelta < 1 or scelta > len(candidati_lista):
-                try:
-                    risposta = input(f"Quale ricetta vuoi preparare? (1-{len(candidati_lista)}): ").strip()
-                    scelta = int(risposta)
-                    if scelta < 1 or scelta > len(candidati_lista):
-                        print("Scelta non valida. Inserisci un numero della lista.")
-                except ValueError:
-                    print("Input non valido. Inserisci un numero.")
-            
-            ricetta_scelta = candidati_lista[scelta-1]
-            logger.info(f"Hai scelto: {ricetta_scelta}")
+            return ricetta_scelta
 
-        # Dichiara la ricetta scelta per far partire la valutazione
-        self.declare(Fact(ricetta_suggerita=ricetta_scelta))
-        self.declare(Fact(azione="valutaRicetta"))
+        if sys.stdin is None or not sys.stdin.isatty():
+            # --- Esecuzione non interattiva (batch, valutazione): nessun input() ---
+            ricetta_scelta = self._rank_candidati(candidati_lista)
+            logger.info(f"\nHo trovato più ricette, scelgo automaticamente: {ricetta_scelta}")
+            return ricetta_scelta
+
+        # --- Se ci sono più candidati, fai scegliere l'utente ---
+        logger.info("\nHo trovato più ricette che corrispondono ai tuoi criteri:")
+        for i, nome in enumerate(candidati_lista):
+            print(f"({i+1}) {nome}") # Usiamo print per l'interazione
+
+        scelta = 0
+        while scelta < 1 or scelta > len(candidati_lista):
+            try:
+                risposta = input(f"Quale ricetta vuoi preparare? (1-{len(candidati_lista)}): ").strip()
+                scelta = int(risposta)
+                if scelta < 1 or scelta > len(candidati_lista):
+                    print("Scelta non valida. Inserisci un numero della lista.")
+            except ValueError:
+                print("Input non valido. Inserisci un numero.")
+
+        ricetta_scelta = candidati_lista[scelta-1]
+        logger.info(f"Hai scelto: {ricetta_scelta}")
+        return ricetta_scelta
 
     # --------------------------------------------------------------------------
     # Regola "di fallback" (Priorità 0) ---
     # Si attiva solo se 'trovaRicetta' è attivo E non è stato trovato NESSUN candidato
     # --------------------------------------------------------------------------
     @Rule(Fact(azione="trovaRicetta"),
-          NOT(Fact(candidato=W())), # Si attiva solo se NESSUNA regola 'suggerisci' ha avuto successo
+          Fact(no_candidati=True), # Dichiarato da 'verifica_candidati' se nessuna regola 'suggerisci' ha avuto successo
           salience=0) 
     def nessuna_ricetta_trovata(self):
           logger.info("\nMi dispiace, non ho trovato ricette *perfette* che usino tutti i tuoi ingredienti e il tempo a disposizione.")
           logger.info("Provo a cercare nell'ontologia ricette che usano almeno uno degli ingredienti forniti...")
           
-          ingredienti_utente = []
-          for fact in self.facts.values():
-              if 'ingrediente' in fact:
-                  ingredienti_utente.append(fact['ingrediente'])
+          ingredienti_utente = list(self._ingredienti)
           
           if not ingredienti_utente:
               logger.warning("Nessun ingrediente trovato nei fatti per la ricerca parziale.")
@@ -196,7 +252,7 @@ class ConsulenteRicette(KnowledgeEngine):
 
         if nome_alternativa:
             risposta = ""
-            while risposta not in ['s', 'n']:
+            while risposta not in _SI_NO:
                 print(f"\nÈ stata trovata un'alternativa simile: {nome_alternativa}")
                 risposta = input("Vuoi vederne i dettagli? (s/n): ").strip().lower()
 